@@ -10,8 +10,10 @@ import pvlib
 import pytz
 from pathlib import Path
 from typing import NamedTuple
+from django.conf import settings
 
 from .credentials import NREL_API_KEY, NREL_API_EMAIL
+from . import upstream
 
 # Define a few permanent constants
 JOULES_PER_KWH = 3.6e+6
@@ -94,14 +96,23 @@ class HomeCharacteristics:
 
 def get_solar_timeseries(home):
 
-    solar_weather_timeseries, solar_weather_metadata = pvlib.iotools.get_psm3(
-        latitude=home.latitude,
-        longitude=home.longitude,
-        names=SIMULATION_YEAR,
-        api_key=NREL_API_KEY,
-        email=NREL_API_EMAIL,
-        map_variables=True,
-        leap_day=True,
+    # pvlib makes its own request, so it can't share the pooled session, but still gets the deadline,
+    # retries, circuit breaker and cache
+    def fetch_psm3(session, timeout):
+        return pvlib.iotools.get_psm3(
+            latitude=home.latitude,
+            longitude=home.longitude,
+            names=SIMULATION_YEAR,
+            api_key=NREL_API_KEY,
+            email=NREL_API_EMAIL,
+            map_variables=True,
+            leap_day=True,
+            url=settings.NREL_PSM3_URL,
+            timeout=timeout,
+        )
+
+    solar_weather_timeseries, solar_weather_metadata = upstream.service('nrel').cached(
+        (home.latitude, home.longitude, SIMULATION_YEAR), fetch_psm3
     )
 
     solar_position_timeseries = pvlib.solarposition.get_solarposition(
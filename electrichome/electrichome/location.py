@@ -1,17 +1,22 @@
 import requests
 
+from . import upstream
+
 
 def get_geocode_info(zip_code):
     base_url = 'https://geocode.maps.co/search'
     params = {'q': '%s+US' % zip_code}
 
-    try:
-        response = requests.get(base_url, params=params)
+    def fetch_geocode(session, timeout):
+        response = session.get(base_url, params=params, timeout=timeout)
         response.raise_for_status()
-        data = response.json()
+        return response.json()
+
+    try:
+        data = upstream.service('geocode_maps').cached(zip_code, fetch_geocode)
   #      print(data)
         return data
-    except requests.RequestException as e:
+    except (requests.RequestException, upstream.UpstreamError) as e:
         print(f"Error making request: {e}")
         return None
 
@@ -127,6 +127,77 @@ STATICFILES_DIRS = [
 
 STATIC_ROOT = LOCAL_STATIC_ROOT
 
+# Third-party API endpoints
+# These can be overridden from the environment, e.g. to point at the local stand-ins
+# started by the load-test harness (see loadtest/). Leaving the NREL URL unset lets
+# pvlib pick the right PSM3 endpoint itself.
+
+NREL_PSM3_URL = os.environ.get('ELECTRICHOME_NREL_PSM3_URL')
+
+OPENCAGE_API_URL = 'https://api.opencagedata.com/geocode/v1/json'
+
+OPENCAGE_GEOCODE_URL = os.environ.get('ELECTRICHOME_OPENCAGE_GEOCODE_URL', OPENCAGE_API_URL)
+
+# How we call each third-party API (see upstream.py). Durations are in seconds.
+# `deadline` bounds a whole call including retries; answers older than `fresh_for` are
+# still served for up to `stale_for` more while they're refreshed in the background.
+# Typical-year weather and city locations don't change, so both are cached for a long time.
+
+UPSTREAM_SERVICES = {
+    'nrel': {
+        'timeout': 15,
+        'deadline': 30,
+        'retries': 2,
+        'fresh_for': 30 * 24 * 60 * 60,
+        'stale_for': 365 * 24 * 60 * 60,
+        'cache_alias': 'weather',
+    },
+    'opencage': {
+        'timeout': 3,
+        'deadline': 6,
+        'retries': 2,
+        'fresh_for': 30 * 24 * 60 * 60,
+        'stale_for': 365 * 24 * 60 * 60,
+        'cache_alias': 'geocodes',
+    },
+    'geocode_maps': {
+        'timeout': 3,
+        'deadline': 6,
+        'retries': 2,
+        'fresh_for': 30 * 24 * 60 * 60,
+        'stale_for': 365 * 24 * 60 * 60,
+        'cache_alias': 'geocodes',
+    },
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # The caches below live in each worker process's memory, so count them when sizing workers.
+    # NREL weather years from upstream.py. Each is about 1 MB pickled (8760 hourly rows), and is
+    # unpickled on every hit, so this is kept small: up to ~32 MB per worker.
+    'weather': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'weather',
+        'OPTIONS': {
+            'MAX_ENTRIES': 32,
+        },
+    },
+    # Geocoding answers from upstream.py, a few KB each: up to ~10 MB per worker.
+    'geocodes': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'geocodes',
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+}
+
 # Needed during deployment, not development
 # STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
@@ -0,0 +1,318 @@
+import threading
+import time
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from . import upstream
+from .upstream import CircuitBreaker, CircuitOpenError, Upstream, UpstreamError
+
+
+class FakeClock:
+    '''Stands in for the `time` module in upstream.py, so tests control how much time passes.'''
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f'{status_code} error', response=response)
+
+
+class FakeFetch:
+    '''A `fetch` callable that raises or returns each of `outcomes` in turn.'''
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def __call__(self, session, timeout):
+        self.calls += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+class FakeClockTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(upstream, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        # Always back off for the longest allowed time, so backoff is predictable
+        patcher = mock.patch.object(upstream.random, 'uniform', side_effect=lambda low, high: high)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class CircuitBreakerTests(FakeClockTestCase):
+
+    def open_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        return breaker
+
+    def test_opens_after_threshold(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+    def test_success_resets_failure_count(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_half_open_allows_a_single_trial(self):
+        breaker = self.open_breaker()
+        self.clock.sleep(30)
+        self.assertEqual(breaker.state, 'half_open')
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+    def test_successful_trial_closes(self):
+        breaker = self.open_breaker()
+        self.clock.sleep(30)
+        breaker.allow()
+        breaker.record_success()
+        self.assertEqual(breaker.state, 'closed')
+        self.assertTrue(breaker.allow())
+
+    def test_failed_trial_reopens(self):
+        breaker = self.open_breaker()
+        self.clock.sleep(30)
+        breaker.allow()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+
+
+class RequestTests(FakeClockTestCase):
+
+    def test_retries_transient_failures(self):
+        fetch = FakeFetch(requests.ConnectionError(), http_error(503), 'answer')
+        service = Upstream('test', retries=2, backoff=0.1, deadline=10)
+        self.assertEqual(service.request(fetch), 'answer')
+        self.assertEqual(fetch.calls, 3)
+        self.assertAlmostEqual(self.clock.now, 1000.3)  # Backed off 0.1s, then 0.2s
+
+    def test_gives_up_after_retries(self):
+        fetch = FakeFetch(requests.Timeout())
+        service = Upstream('test', retries=2, backoff=0.1, deadline=10)
+        with self.assertRaises(UpstreamError):
+            service.request(fetch)
+        self.assertEqual(fetch.calls, 3)
+
+    def test_client_error_is_not_retried_and_counts_as_success(self):
+        fetch = FakeFetch(http_error(404))
+        service = Upstream('test', retries=2)
+        service.breaker.record_failure()
+        with self.assertRaises(requests.HTTPError):
+            service.request(fetch)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(service.breaker.failures, 0)
+
+    def test_stops_retrying_when_backoff_would_pass_deadline(self):
+        fetch = FakeFetch(requests.ConnectionError())
+        service = Upstream('test', retries=5, backoff=1, deadline=1)
+        with self.assertRaises(UpstreamError):
+            service.request(fetch)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(self.clock.now, 1000.0)
+
+    def test_open_circuit_fails_fast(self):
+        fetch = FakeFetch(requests.ConnectionError())
+        service = Upstream('test', retries=0, failure_threshold=1)
+        with self.assertRaises(UpstreamError):
+            service.request(fetch)
+        with self.assertRaises(CircuitOpenError):
+            service.request(fetch)
+        self.assertEqual(fetch.calls, 1)
+
+
+class DeadlineTests(SimpleTestCase):
+
+    def test_slow_call_is_cut_off_at_deadline(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def trickling_fetch(session, timeout):
+            # Like a response that keeps sending a byte just inside requests' read timeout
+            release.wait(5)
+            return 'too late'
+
+        service = Upstream('test', timeout=1, deadline=0.2, retries=2)
+        start = time.monotonic()
+        with self.assertRaises(UpstreamError):
+            service.request(trickling_fetch)
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(service.breaker.failures, 1)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'upstream-tests'}})
+class CachedTests(FakeClockTestCase):
+
+    def setUp(self):
+        super().setUp()
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_fresh_answer_is_served_from_cache(self):
+        fetch = FakeFetch('answer')
+        service = Upstream('test', fresh_for=10)
+        self.assertEqual(service.cached('key', fetch), 'answer')
+        self.assertEqual(service.cached('key', fetch), 'answer')
+        self.assertEqual(fetch.calls, 1)
+
+    def test_stale_answer_is_served_while_refreshing(self):
+        fetch = FakeFetch('old', 'new')
+        service = Upstream('test', fresh_for=10, stale_for=100)
+        service.cached('key', fetch)
+        self.clock.sleep(11)
+
+        self.assertEqual(service.cached('key', fetch), 'old')
+        service._refreshes.shutdown(wait=True)
+        self.assertEqual(fetch.calls, 2)
+        self.assertEqual(service.cached('key', fetch), 'new')
+
+    def test_failed_fetch_is_not_cached(self):
+        fetch = FakeFetch(http_error(404), 'answer')
+        service = Upstream('test')
+        with self.assertRaises(requests.HTTPError):
+            service.cached('key', fetch)
+        self.assertEqual(service.cached('key', fetch), 'answer')
+
+    def test_concurrent_misses_share_one_fetch(self):
+        started = threading.Event()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        calls = []
+
+        def slow_fetch(session, timeout):
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return 'answer'
+
+        service = Upstream('test')
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(service.cached('key', slow_fetch))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        started.wait(5)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, ['answer'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_hits_queue_one_refresh_while_refreshes_are_busy(self):
+        started = threading.Semaphore(0)
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def blocking_fetch(session, timeout):
+            started.release()
+            release.wait(5)
+            return 'new'
+
+        fetch = FakeFetch('old', 'new')
+        service = Upstream('test', fresh_for=10)
+        for key in ('busy 1', 'busy 2'):
+            service.cached(key, FakeFetch('old'))
+        service.cached('key', fetch)
+        self.clock.sleep(11)
+
+        # Tie up both refresh threads, so the refresh for 'key' has to wait in the queue
+        for key in ('busy 1', 'busy 2'):
+            service.cached(key, blocking_fetch)
+        started.acquire(timeout=5)
+        started.acquire(timeout=5)
+
+        for _ in range(20):
+            self.assertEqual(service.cached('key', fetch), 'old')
+        release.set()
+        service._refreshes.shutdown(wait=True)
+
+        self.assertEqual(fetch.calls, 2)
+
+
+class MyViewTests(SimpleTestCase):
+
+    @mock.patch('electrichome.views._do_the_thing', side_effect=UpstreamError('nrel is unavailable'))
+    def test_weather_outage_shows_form_error(self, do_the_thing):
+        response = self.client.post('/', {
+            'latitude': 42.36,
+            'longitude': -71.06,
+            'square_footage': 2000,
+            'ceiling_height': 9,
+            'heat_temperature': 72,
+            'cool_temperature': 72,
+            'south_facing_window_size': 100,
+        })
+        self.assertEqual(response.status_code, 503)
+        self.assertContains(response, 'Weather data is temporarily unavailable', status_code=503)
+
+
+@mock.patch('electrichome.views.OPEN_CAGE_API_KEY', 'SECRETOPENCAGEKEY')
+class GeocodeViewTests(SimpleTestCase):
+    # What requests puts in its error messages: the full URL, API key included
+    url = 'http://opencage.test/?q=Boston%2C+MA&key=SECRETOPENCAGEKEY'
+
+    def geocode(self, cached):
+        service = mock.Mock()
+        service.cached.side_effect = cached
+        with mock.patch.object(upstream, 'service', return_value=service):
+            return self.client.get('/api/geocode/Boston/MA/')
+
+    def test_returns_coordinates(self):
+        response = self.geocode(lambda key, fetch: {'results': [{'geometry': {'lat': 42.36, 'lng': -71.06}}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'latitude': 42.36, 'longitude': -71.06})
+
+    def test_no_results(self):
+        response = self.geocode(lambda key, fetch: {'results': []})
+        self.assertEqual(response.status_code, 400)
+
+    def test_outage_does_not_leak_api_key(self):
+        error = UpstreamError(f'opencage failed after 3 attempt(s): 503 Server Error for url: {self.url}')
+        with self.assertLogs('electrichome.views', 'WARNING'):
+            response = self.geocode(error)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.json(), {'error': 'Geocoding is temporarily unavailable'})
+        self.assertNotContains(response, 'SECRETOPENCAGEKEY', status_code=503)
+
+    def test_rejected_request_does_not_leak_api_key(self):
+        error = http_error(404)
+        error.args = (f'404 Client Error for url: {self.url}',)
+        with self.assertLogs('electrichome.views', 'WARNING'):
+            response = self.geocode(error)
+        self.assertEqual(response.status_code, 400)
+        self.assertNotContains(response, 'SECRETOPENCAGEKEY', status_code=400)
+
+    def test_unexpected_error_does_not_leak_api_key(self):
+        with self.assertLogs('electrichome.views', 'ERROR'):
+            response = self.geocode(requests.exceptions.InvalidURL(self.url))
+        self.assertEqual(response.status_code, 500)
+        self.assertNotContains(response, 'SECRETOPENCAGEKEY', status_code=500)
@@ -0,0 +1,252 @@
+import hashlib
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# Responses worth trying again: the service is overloaded or having a bad moment
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    '''A third-party service couldn't give us an answer in time, and there was nothing cached to fall back on.'''
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class CircuitBreaker:
+    '''
+    Stops calling a service that keeps failing, so requests fail fast instead of each waiting out a timeout.
+
+    After `failure_threshold` failures in a row the circuit opens and every call is refused for `reset_timeout`
+    seconds. After that a single trial call is let through (half-open): if it succeeds the circuit closes again,
+    if it fails the circuit stays open for another `reset_timeout`.
+    '''
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+
+class Upstream:
+    '''
+    Everything we need to call one third-party service safely:
+      1. A pooled session, so connections are reused between requests
+      2. A deadline for the whole call, including retries, so a slow service can't hold a worker indefinitely
+      3. A bounded number of retries with jittered exponential backoff, for transient failures only
+      4. A circuit breaker, so a service that is down fails fast
+      5. A stale-while-revalidate cache, so users get cached answers while they are refreshed in the background,
+         with concurrent requests for the same missing answer sharing a single fetch
+
+    Answers are stored in the Django cache named by `cache_alias`. All durations are in seconds.
+    '''
+
+    def __init__(
+        self,
+        name,
+        timeout=5,
+        deadline=10,
+        retries=2,
+        backoff=0.2,
+        max_backoff=2,
+        pool_size=10,
+        failure_threshold=5,
+        reset_timeout=30,
+        fresh_for=24 * 60 * 60,
+        stale_for=7 * 24 * 60 * 60,
+        cache_alias='default',
+    ):
+        self.name = name
+        self.timeout = timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.fresh_for = fresh_for
+        self.stale_for = stale_for
+        self.cache_alias = cache_alias
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        self.session = requests.Session()
+        # We do our own retrying, so the adapter shouldn't
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        # Calls run here so we can stop waiting on them at the deadline. A call that overruns keeps its
+        # thread until requests' own timeout gives up, so this also caps how many can pile up.
+        self._calls = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix=f'upstream-{name}')
+        self._refreshes = ThreadPoolExecutor(max_workers=2, thread_name_prefix=f'upstream-{name}-refresh')
+        self._in_flight = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def request(self, fetch):
+        '''
+        Calls `fetch(session, timeout)` until it succeeds, retrying transient failures while the deadline allows.
+        `fetch` should raise a requests exception on failure (e.g. via `response.raise_for_status()`).
+        '''
+        give_up_at = time.monotonic() + self.deadline
+        attempt = 0
+
+        while True:
+            if not self.breaker.allow():
+                raise CircuitOpenError(f'{self.name} is unavailable, not calling it for now')
+
+            remaining = give_up_at - time.monotonic()
+            # requests' timeout only bounds connecting and each socket read, so a response trickling in
+            # slowly could run far past it. Waiting on a future bounds the whole call by the deadline.
+            call = self._calls.submit(fetch, self.session, min(self.timeout, remaining))
+            try:
+                value = call.result(timeout=remaining)
+            except FutureTimeoutError:
+                call.cancel()
+                self.breaker.record_failure()
+                error = TimeoutError(f'no answer within the {self.deadline}s deadline')
+            except requests.RequestException as e:
+                if not _is_retryable(e):
+                    # The service answered, it just didn't like the request
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                error = e
+            except Exception:
+                # The service answered but we couldn't make sense of it; retrying won't help
+                self.breaker.record_success()
+                raise
+            else:
+                self.breaker.record_success()
+                return value
+
+            # "Full jitter" backoff: wait a random time up to the exponential backoff, so retries don't bunch up
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            attempt += 1
+            if attempt > self.retries or time.monotonic() + delay >= give_up_at:
+                raise UpstreamError(f'{self.name} failed after {attempt} attempt(s): {error}') from error
+            time.sleep(delay)
+
+    def cached(self, key, fetch):
+        '''
+        Returns the cached answer for `key` if there is one, fetching it with `request(fetch)` if not.
+        Answers older than `fresh_for` are still returned, but refreshed in the background for next time.
+        '''
+        cache_key = self._cache_key(key)
+        entry = caches[self.cache_alias].get(cache_key)
+
+        if entry is None:
+            return self._fetch_once(cache_key, fetch)
+
+        stored_at, value = entry
+        if time.time() - stored_at > self.fresh_for:
+            self._refresh_in_background(cache_key, fetch)
+        return value
+
+    def _cache_key(self, key):
+        # Hash the key so arbitrary user input (e.g. city names with spaces) makes a valid cache key
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return f'{self.name}:{digest}'
+
+    def _fetch_once(self, cache_key, fetch):
+        '''
+        Fetches and caches the answer for `cache_key`. If a fetch for the same key is already running,
+        waits for that one instead of calling the service again.
+        '''
+        with self._lock:
+            pending = self._in_flight.get(cache_key)
+            if pending is None:
+                pending = self._in_flight[cache_key] = Future()
+                leader = True
+            else:
+                leader = False
+
+        if leader:
+            try:
+                value = self.request(fetch)
+                caches[self.cache_alias].set(cache_key, (time.time(), value), timeout=self.fresh_for + self.stale_for)
+                pending.set_result(value)
+            except Exception as e:
+                pending.set_exception(e)
+            finally:
+                with self._lock:
+                    del self._in_flight[cache_key]
+
+        return pending.result()
+
+    def _refresh_in_background(self, cache_key, fetch):
+        with self._lock:
+            # One refresh per key is enough, whether it's queued, running, or someone is already fetching it.
+            # Marking it here rather than when the refresh starts keeps stale hits from queueing up duplicates
+            # while the refresh threads are busy.
+            if cache_key in self._refreshing or cache_key in self._in_flight:
+                return
+            self._refreshing.add(cache_key)
+
+        def refresh():
+            try:
+                self._fetch_once(cache_key, fetch)
+            except Exception:
+                logger.warning('Background refresh from %s failed, still serving the stale answer', self.name, exc_info=True)
+            finally:
+                with self._lock:
+                    self._refreshing.discard(cache_key)
+
+        self._refreshes.submit(refresh)
+
+
+def _is_retryable(error):
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code in RETRYABLE_STATUS_CODES
+
+
+@lru_cache(maxsize=None)
+def service(name):
+    '''The shared `Upstream` for a service configured in settings.UPSTREAM_SERVICES, one per process.'''
+    return Upstream(name, **settings.UPSTREAM_SERVICES.get(name, {}))
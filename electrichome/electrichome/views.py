@@ -1,12 +1,17 @@
 from django.shortcuts import render
 from django import forms
 from django.http import JsonResponse
+from django.conf import settings
+import logging
 import requests
 
 from .location import get_lat_long
 from .hex import HomeCharacteristics, get_solar_timeseries, get_monthly_energy_balance, get_yearly_energy_usage, heating_types
 from .credentials import OPEN_CAGE_API_KEY
 from . import conversions
+from . import upstream
+
+logger = logging.getLogger(__name__)
 
 class MyForm(forms.Form):
 
@@ -24,6 +29,7 @@ class MyForm(forms.Form):
 def my_view(request):
     submitted_data = None
     calculated_data = None
+    status = 200
 
     if request.method == 'POST':
         form = MyForm(request.POST)
@@ -39,7 +45,13 @@ def my_view(request):
 
                 'south_facing_window_size': conversions.squareft_to_squaremeter(form.cleaned_data['south_facing_window_size']),
             }
-            calculated_data = _do_the_thing(submitted_data)
+            try:
+                calculated_data = _do_the_thing(submitted_data)
+            except upstream.UpstreamError:
+                # NREL is down or too slow, and we don't have this location's weather cached
+                form.add_error(None, 'Weather data is temporarily unavailable. Please try again in a few minutes.')
+                submitted_data = None
+                status = 503
     else:
         form = MyForm()
 
@@ -47,7 +59,7 @@ def my_view(request):
         'form': form,
         'submitted_data': submitted_data,
         'calculated_data': calculated_data
-    })
+    }, status=status)
 
 AIR_CHANGE_RATE_BEFORE = 17
 AIR_CHANGE_RATE_AFTER = 10
@@ -130,16 +142,28 @@ def _do_the_thing(submitted_data):
 def geocode(request, city, state):
     location = f'{city}, {state}'
     opencage_api_key = OPEN_CAGE_API_KEY
-    opencage_url = f'https://api.opencagedata.com/geocode/v1/json?q={location}&key={opencage_api_key}'
+    params = {'q': location, 'key': opencage_api_key}
+
+    def fetch_geocode(session, timeout):
+        response = session.get(settings.OPENCAGE_GEOCODE_URL, params=params, timeout=timeout)
+        response.raise_for_status()
+        return response.json()
 
+    # Request errors include the URL, API key and all, so their details only go to the log
     try:
-        response = requests.get(opencage_url)
-        data = response.json()
+        data = upstream.service('opencage').cached(location, fetch_geocode)
 
-        if response.status_code == 200 and 'results' in data:
+        if data.get('results'):
             result = data['results'][0]['geometry']
             return JsonResponse({'latitude': result['lat'], 'longitude': result['lng']})
         else:
             return JsonResponse({'error': 'Geocoding failed'}, status=400)
-    except Exception as e:
-        return JsonResponse({'error': str(e)}, status=500)
+    except upstream.UpstreamError:
+        logger.warning('Geocoding %r failed', location, exc_info=True)
+        return JsonResponse({'error': 'Geocoding is temporarily unavailable'}, status=503)
+    except requests.HTTPError:
+        logger.warning('Geocoding %r was rejected', location, exc_info=True)
+        return JsonResponse({'error': 'Geocoding failed'}, status=400)
+    except Exception:
+        logger.exception('Geocoding %r failed', location)
+        return JsonResponse({'error': 'Geocoding failed'}, status=500)
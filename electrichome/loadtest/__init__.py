@@ -0,0 +1,7 @@
+"""
+Offline load-test harness for the calculator.
+
+Starts local stand-ins for the NREL PSM3 and OpenCage APIs that replay recorded responses, points the app
+at them through settings, and drives concurrent form submissions against the WSGI and ASGI applications.
+See the README for usage.
+"""
@@ -0,0 +1,108 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
+
+from .driver import DEFAULT_FORM_DATA, format_report, run_worker
+from .stubs import nrel_stub, opencage_stub
+
+FIXTURES_DIR = Path(__file__).resolve().parent / 'fixtures'
+
+
+def _start_stubs(stack, args, record=False):
+    if record:
+        from pvlib.iotools.psm3 import TMY_URL
+        from electrichome.settings import OPENCAGE_API_URL
+        nrel_options = {'upstream': TMY_URL}
+        opencage_options = {'upstream': OPENCAGE_API_URL}
+    else:
+        nrel_options = {'latency': args.nrel_latency, 'jitter': args.nrel_jitter, 'error_rate': args.nrel_error_rate}
+        opencage_options = {'latency': args.opencage_latency, 'jitter': args.opencage_jitter, 'error_rate': args.opencage_error_rate}
+
+    stubs = {
+        'NREL': stack.enter_context(nrel_stub(args.fixtures, **nrel_options)),
+        'OpenCage': stack.enter_context(opencage_stub(args.fixtures, **opencage_options)),
+    }
+
+    # Settings read these when the app is imported, so they must be set before any worker starts
+    os.environ['ELECTRICHOME_NREL_PSM3_URL'] = stubs['NREL'].url
+    os.environ['ELECTRICHOME_OPENCAGE_GEOCODE_URL'] = stubs['OpenCage'].url
+    return stubs
+
+
+def _spawn_context():
+    # Spawn rather than fork, so each worker imports Django fresh (and reads the stub URLs from the
+    # environment) like a real app server worker
+    return multiprocessing.get_context('spawn')
+
+
+def record(args):
+    # Run a single visitor session against the real APIs, through the stubs, which save what comes back
+    with ExitStack() as stack:
+        stubs = _start_stubs(stack, args, record=True)
+        with ProcessPoolExecutor(max_workers=1, mp_context=_spawn_context()) as pool:
+            result = pool.submit(
+                run_worker, 0, 'wsgi', 1, 1, args.host, args.city, args.state, DEFAULT_FORM_DATA,
+            ).result()
+
+    statuses = {route: status for route, _, status in result['samples']}
+    print(f'Recorded session: {statuses}')
+    for stub in stubs.values():
+        print(f'  {stub.fixture}: {"saved" if stub.fixture.exists() else "MISSING"}')
+
+
+def run(args):
+    protocols = ['wsgi', 'asgi'] if args.protocol == 'both' else [args.protocol]
+    context = _spawn_context()
+
+    for protocol in protocols:
+        with ExitStack() as stack:
+            stubs = _start_stubs(stack, args)
+            with ProcessPoolExecutor(max_workers=args.workers, mp_context=context) as pool:
+                futures = [
+                    pool.submit(
+                        run_worker, worker_id, protocol, args.sessions, args.concurrency,
+                        args.host, args.city, args.state, DEFAULT_FORM_DATA,
+                    )
+                    for worker_id in range(args.workers)
+                ]
+                results = [future.result() for future in futures]
+
+            print(format_report(protocol, results, stubs))
+            print()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog='python -m loadtest',
+        description='Load-test the calculator offline, with local stand-ins for the NREL and OpenCage APIs.',
+    )
+    parser.add_argument('--fixtures', type=Path, default=FIXTURES_DIR, help='Directory holding the recorded API responses')
+    parser.add_argument('--host', default='localhost', help='Host header to send; must be in ALLOWED_HOSTS')
+    parser.add_argument('--city', default='Boston')
+    parser.add_argument('--state', default='MA')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('record', help='Record real API responses into the fixtures directory (needs credentials.py)')
+
+    run_parser = subparsers.add_parser('run', help='Replay the recorded responses and drive concurrent form submissions')
+    run_parser.add_argument('--protocol', choices=['wsgi', 'asgi', 'both'], default='both')
+    run_parser.add_argument('--workers', type=int, default=2, help='Worker processes, like an app server\'s worker count')
+    run_parser.add_argument('--concurrency', type=int, default=4, help='Sessions in flight per worker')
+    run_parser.add_argument('--sessions', type=int, default=10, help='Sessions each worker runs')
+    for service in ('nrel', 'opencage'):
+        run_parser.add_argument(f'--{service}-latency', type=float, default=0.2, help='Base response time (seconds)')
+        run_parser.add_argument(f'--{service}-jitter', type=float, default=0.1, help='Extra random response time, up to this (seconds)')
+        run_parser.add_argument(f'--{service}-error-rate', type=float, default=0.0, help='Fraction of requests answered with a 503')
+
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
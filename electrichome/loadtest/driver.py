@@ -0,0 +1,325 @@
+import asyncio
+import io
+import json
+import math
+import os
+import re
+import resource
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import quote, urlencode
+from wsgiref.util import setup_testing_defaults
+
+CSRF_TOKEN_PATTERN = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+
+# Values a visitor would leave at their defaults on the home form
+DEFAULT_FORM_DATA = {
+    'square_footage': 2000,
+    'ceiling_height': 9,
+    'heat_temperature': 72,
+    'cool_temperature': 72,
+    'south_facing_window_size': 100,
+}
+
+
+def _build_request(host, cookies, form):
+    body = urlencode(form).encode('utf-8') if form else b''
+    headers = {'Host': host}
+    if cookies:
+        headers['Cookie'] = '; '.join(f'{name}={value}' for name, value in cookies.items())
+    if form:
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        headers['Content-Length'] = str(len(body))
+    return body, headers
+
+
+class WSGIClient:
+    '''Calls a WSGI application directly, the same way a WSGI server would.'''
+
+    def __init__(self, application, host):
+        self.application = application
+        self.host = host
+
+    def request(self, method, path, cookies=None, form=None):
+        body, headers = _build_request(self.host, cookies, form)
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'wsgi.input': io.BytesIO(body),
+        }
+        for name, value in headers.items():
+            key = name.upper().replace('-', '_')
+            if key not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                key = 'HTTP_' + key
+            environ[key] = value
+        setup_testing_defaults(environ)
+
+        response = {}
+
+        def start_response(status, response_headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = response_headers
+
+        chunks = self.application(environ, start_response)
+        try:
+            content = b''.join(chunks)
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+        return response['status'], response['headers'], content
+
+
+class ASGIClient:
+    '''Calls an ASGI application directly, the same way an ASGI server would.'''
+
+    def __init__(self, application, host):
+        self.application = application
+        self.host = host
+
+    async def request(self, method, path, cookies=None, form=None):
+        body, headers = _build_request(self.host, cookies, form)
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': method,
+            'scheme': 'http',
+            'path': path,
+            'raw_path': path.encode('utf-8'),
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers.items()],
+            'client': ('127.0.0.1', 0),
+            'server': (self.host, 80),
+        }
+
+        response = {'headers': [], 'content': b''}
+        request_sent = False
+        response_done = asyncio.Event()
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            # Only report the client going away once the response is complete
+            await response_done.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = [(name.decode('latin-1'), value.decode('latin-1')) for name, value in message.get('headers', [])]
+            elif message['type'] == 'http.response.body':
+                response['content'] += message.get('body', b'')
+                if not message.get('more_body', False):
+                    response_done.set()
+
+        await self.application(scope, receive, send)
+        response_done.set()
+
+        return response['status'], response['headers'], response['content']
+
+
+def _cookies_from(headers):
+    cookies = {}
+    for name, value in headers:
+        if name.lower() == 'set-cookie':
+            cookies.update({key: morsel.value for key, morsel in SimpleCookie(value).items()})
+    return cookies
+
+
+class Session:
+    '''
+    One visitor going through the form, step by step:
+      1. Load the page (picks up the CSRF cookie and token)
+      2. Look up the city through the geocode API
+      3. Submit the home form with the returned coordinates
+    Each step is a generator yielding a request and receiving the response, so the same flow can be
+    driven by the blocking WSGI client and the async ASGI client.
+    '''
+
+    def __init__(self, city, state, form_data):
+        self.city = city
+        self.state = state
+        self.form_data = form_data
+
+    def steps(self):
+        status, headers, content = yield 'page', ('GET', '/', None, None)
+        if status != 200:
+            return
+        cookies = _cookies_from(headers)
+        match = CSRF_TOKEN_PATTERN.search(content.decode('utf-8'))
+
+        geocode_path = f'/api/geocode/{quote(self.city)}/{quote(self.state)}/'
+        status, headers, content = yield 'geocode', ('GET', geocode_path, None, None)
+        if status != 200 or match is None:
+            return
+        location = json.loads(content)
+
+        form = dict(self.form_data)
+        form.update({
+            'csrfmiddlewaretoken': match.group(1),
+            'latitude': location['latitude'],
+            'longitude': location['longitude'],
+        })
+        yield 'submit', ('POST', '/', cookies, form)
+
+
+def _timed(samples, route, call):
+    start = time.perf_counter()
+    try:
+        status, headers, content = call()
+    except Exception:
+        status, headers, content = None, [], b''
+    samples.append((route, time.perf_counter() - start, status))
+    return status, headers, content
+
+
+def _mark_unusable(session_samples):
+    # The session couldn't carry on with the last response (e.g. an unexpected geocode body),
+    # so count that request as an error rather than letting the session vanish from the report
+    route, latency, _ = session_samples[-1]
+    session_samples[-1] = (route, latency, None)
+
+
+def run_wsgi_session(client, session, samples):
+    session_samples = []
+    steps = session.steps()
+    response = None
+    try:
+        while True:
+            route, args = steps.send(response)
+            response = _timed(session_samples, route, lambda: client.request(*args))
+    except StopIteration:
+        pass
+    except Exception:
+        _mark_unusable(session_samples)
+    samples.extend(session_samples)
+
+
+async def run_asgi_session(client, session, samples):
+    session_samples = []
+    steps = session.steps()
+    response = None
+    try:
+        while True:
+            route, args = steps.send(response)
+            start = time.perf_counter()
+            try:
+                response = await client.request(*args)
+            except Exception:
+                response = (None, [], b'')
+            session_samples.append((route, time.perf_counter() - start, response[0]))
+    except StopIteration:
+        pass
+    except Exception:
+        _mark_unusable(session_samples)
+    samples.extend(session_samples)
+
+
+def _usage():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def run_worker(worker_id, protocol, sessions, concurrency, host, city, state, form_data):
+    '''
+    Entry point for one worker process, mirroring one worker of a pre-forking app server.
+    Runs `sessions` visitor sessions, `concurrency` at a time, and reports its own timings and resource use.
+    '''
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'electrichome.settings')
+    if protocol == 'wsgi':
+        from electrichome.wsgi import application
+    else:
+        from electrichome.asgi import application
+
+    # Django loads the URLconf and views lazily, so get that out of the way before timing anything
+    if protocol == 'wsgi':
+        client = WSGIClient(application, host)
+        client.request('GET', '/')
+    else:
+        client = ASGIClient(application, host)
+        asyncio.run(client.request('GET', '/'))
+
+    samples = []
+    cpu_before, _ = _usage()
+    start = time.perf_counter()
+
+    if protocol == 'wsgi':
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            futures = [
+                pool.submit(run_wsgi_session, client, Session(city, state, form_data), samples)
+                for _ in range(sessions)
+            ]
+            # Surface anything that went wrong in the driver itself instead of quietly dropping sessions
+            for future in futures:
+                future.result()
+    else:
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def run_one():
+                async with semaphore:
+                    await run_asgi_session(client, Session(city, state, form_data), samples)
+
+            await asyncio.gather(*(run_one() for _ in range(sessions)))
+
+        asyncio.run(run_all())
+
+    wall_s = time.perf_counter() - start
+    cpu_after, max_rss_kb = _usage()
+
+    return {
+        'worker_id': worker_id,
+        'pid': os.getpid(),
+        'samples': samples,
+        'wall_s': wall_s,
+        'cpu_s': cpu_after - cpu_before,
+        'max_rss_kb': max_rss_kb,
+    }
+
+
+def percentile(values, pct):
+    # Nearest-rank percentile, good enough for latency reporting
+    ordered = sorted(values)
+    rank = max(math.ceil(pct / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def format_report(protocol, results, stubs):
+    # Workers run side by side, so the slowest one bounds the measured window
+    wall_s = max(result['wall_s'] for result in results)
+    samples = [sample for result in results for sample in result['samples']]
+    sessions = sum(1 for route, _, status in samples if route == 'submit' and status == 200)
+    lines = [
+        f'{protocol.upper()}: {len(results)} worker(s), {wall_s:.1f}s measured',
+        f'  throughput: {sessions / wall_s:.2f} completed submissions/s, {len(samples) / wall_s:.2f} requests/s',
+        '',
+        f'  {"route":<10}{"count":>7}{"errors":>8}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}',
+    ]
+    for route in ('page', 'geocode', 'submit'):
+        route_samples = [(latency, status) for name, latency, status in samples if name == route]
+        if not route_samples:
+            continue
+        latencies = [latency * 1000 for latency, _ in route_samples]
+        errors = sum(1 for _, status in route_samples if status != 200)
+        lines.append(
+            f'  {route:<10}{len(route_samples):>7}{errors:>8}'
+            f'{percentile(latencies, 50):>10.1f}{percentile(latencies, 95):>10.1f}{percentile(latencies, 99):>10.1f}'
+        )
+
+    lines += ['', f'  {"worker":<10}{"pid":>8}{"cpu s":>10}{"cpu %":>8}{"max rss MB":>12}']
+    for result in sorted(results, key=lambda result: result['worker_id']):
+        lines.append(
+            f'  {result["worker_id"]:<10}{result["pid"]:>8}{result["cpu_s"]:>10.1f}'
+            f'{100 * result["cpu_s"] / result["wall_s"]:>8.0f}{result["max_rss_kb"] / 1024:>12.1f}'
+        )
+
+    lines.append('')
+    for name, stub in stubs.items():
+        lines.append(f'  {name} stub: {stub.stats["requests"]} requests, {stub.stats["errors"]} injected errors')
+
+    return '\n'.join(lines)
@@ -0,0 +1,118 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
+
+import requests
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        stub = self.server
+
+        # Simulate the time the real service takes to answer
+        time.sleep(stub.latency + random.uniform(0, stub.jitter))
+
+        if stub.upstream:
+            status, body = stub.forward(urlsplit(self.path).query)
+        elif random.random() < stub.error_rate:
+            stub.count('errors')
+            status, body = 503, stub.error_body
+        else:
+            status, body = 200, stub.fixture_body
+
+        stub.count('requests')
+        self.send_response(status)
+        self.send_header('Content-Type', stub.content_type if status == 200 else 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Keep the load-test output readable
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    '''
+    A local stand-in for a third-party API.
+
+    In replay mode every GET is answered with the recorded fixture, after an artificial delay of
+    `latency` seconds plus up to `jitter` seconds, and a fraction `error_rate` of requests fail with a 503.
+
+    In record mode (`upstream` set) requests are forwarded to the real service instead, and the first
+    successful response body is written to the fixture file so it can be replayed later.
+    '''
+    daemon_threads = True
+
+    def __init__(self, fixture, content_type, error_body, latency=0, jitter=0, error_rate=0, upstream=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.fixture = Path(fixture)
+        self.content_type = content_type
+        self.error_body = json.dumps(error_body).encode('utf-8')
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.upstream = upstream
+        self.fixture_body = None if upstream else self.fixture.read_bytes()
+        self.stats = {'requests': 0, 'errors': 0}
+        self.recorded = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def forward(self, query):
+        response = requests.get(f'{self.upstream}?{query}', timeout=120)
+        with self._lock:
+            if response.ok and not self.recorded:
+                self.fixture.parent.mkdir(parents=True, exist_ok=True)
+                self.fixture.write_bytes(response.content)
+                self.recorded = True
+        return response.status_code, response.content
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def nrel_stub(fixtures_dir, **kwargs):
+    # pvlib reads the 'errors' field out of the JSON body of a failed PSM3 request
+    return StubServer(
+        Path(fixtures_dir) / 'psm3.csv',
+        content_type='text/csv',
+        error_body={'errors': ['Simulated NREL outage']},
+        **kwargs
+    )
+
+
+def opencage_stub(fixtures_dir, **kwargs):
+    return StubServer(
+        Path(fixtures_dir) / 'opencage.json',
+        content_type='application/json',
+        error_body={'status': {'code': 503, 'message': 'Simulated OpenCage outage'}, 'results': []},
+        **kwargs
+    )